@@ -0,0 +1,144 @@
+"""Pre-flight dry run of rendered sql to estimate and guard the bytes a BigQuery query will scan."""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from airflow.exceptions import AirflowException
+from google.cloud.bigquery import QueryJobConfig
+
+
+class DryRunCache:
+    """
+    Bytes estimates keyed by sql hash, kept in memory and in a json file shared by processes on the same worker.
+
+    Estimates drift as tables grow so entries expire after `ttl_secs`. Updates to the file hold an exclusive
+    lock on a `.lock` file next to it, so concurrent tasks on the worker do not drop each other's entries.
+
+    :param cache_path: json file to persist estimates to, None keeps them in memory only
+    :type cache_path: str
+    :param ttl_secs: seconds an estimate stays valid
+    :type ttl_secs: int
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, ttl_secs: int = 3600) -> None:
+        self.cache_path = cache_path
+        self.ttl_secs = ttl_secs
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(project_id: str, sql: str) -> str:
+        return hashlib.sha256(f'{project_id}\n{sql}'.encode()).hexdigest()
+
+    def _read_file(self) -> Dict[str, Dict[str, Any]]:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _is_fresh(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return entry is not None and time.time() - entry['estimated_at'] <= self.ttl_secs
+
+    @contextmanager
+    def _file_lock(self):
+        with open(f'{self.cache_path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            # another process may have refreshed an estimate that expired in memory
+            if not self._is_fresh(entry):
+                entry = self._read_file().get(key)
+            if not self._is_fresh(entry):
+                return None
+            self._entries[key] = entry
+            return entry['bytes_processed']
+
+    def put(self, key: str, bytes_processed: int):
+        with self._lock:
+            entry = {'bytes_processed': bytes_processed, 'estimated_at': time.time()}
+            self._entries[key] = entry
+            if not self.cache_path:
+                return
+            with self._file_lock():
+                entries = {k: v for k, v in self._read_file().items() if self._is_fresh(v)}
+                entries[key] = entry
+                # write then rename so readers, which do not take the lock, never see a partial file
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path) or '.')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(temp_path, self.cache_path)
+
+
+dry_run_cache = DryRunCache(
+    cache_path=os.getenv('AIRFLOW_AD_DRY_RUN_CACHE_PATH', f'{tempfile.gettempdir()}/airflow_anomaly_detection_dry_run_cache.json'),
+    ttl_secs=int(os.getenv('AIRFLOW_AD_DRY_RUN_CACHE_TTL_SECS', 3600)),
+)
+
+
+def format_bytes(n_bytes: float) -> str:
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if n_bytes < 1024:
+            return f'{n_bytes:,.2f} {unit}'
+        n_bytes /= 1024
+    return f'{n_bytes:,.2f} TiB'
+
+
+def estimate_bytes_processed(bigquery_client: Any, sql: str, cache: Optional[DryRunCache] = None) -> Tuple[int, bool]:
+    """
+    Dry run sql and return the estimated bytes it would process and whether the estimate came from the cache.
+    """
+    cache = dry_run_cache if cache is None else cache
+    key = cache.make_key(bigquery_client.project, sql)
+    bytes_processed = cache.get(key)
+    if bytes_processed is not None:
+        return bytes_processed, True
+    query_job = bigquery_client.query(sql, job_config=QueryJobConfig(dry_run=True, use_query_cache=False, use_legacy_sql=False))
+    bytes_processed = int(query_job.total_bytes_processed or 0)
+    cache.put(key, bytes_processed)
+    return bytes_processed, False
+
+
+def check_bytes_processed(operator: Any, context: Any, bigquery_hook: Any, sql: str) -> Optional[int]:
+    """
+    Pre-flight check shared by the BigQuery operators, runs if `gcp_dry_run` or `gcp_max_bytes_scanned` is set.
+
+    Logs the estimated bytes, pushes them to xcom as `bytes_processed_estimate` and warns or fails
+    (`gcp_max_bytes_scanned_action`) if they are above `gcp_max_bytes_scanned`.
+    """
+    gcp_dry_run = context['params'].get('gcp_dry_run', False)
+    gcp_max_bytes_scanned = context['params'].get('gcp_max_bytes_scanned', None)
+    gcp_max_bytes_scanned_action = context['params'].get('gcp_max_bytes_scanned_action', 'fail')
+    if gcp_max_bytes_scanned_action not in ('fail', 'warn'):
+        raise ValueError(f'gcp_max_bytes_scanned_action {gcp_max_bytes_scanned_action} is not supported')
+
+    if not gcp_dry_run and not gcp_max_bytes_scanned:
+        return None
+
+    bytes_processed, cached = estimate_bytes_processed(bigquery_hook.get_client(), sql)
+    operator.log.info(f'estimated bytes processed={bytes_processed} ({format_bytes(bytes_processed)}, cached={cached})')
+    context['ti'].xcom_push(key='bytes_processed_estimate', value=bytes_processed)
+
+    if gcp_max_bytes_scanned and bytes_processed > gcp_max_bytes_scanned:
+        message = f'estimated bytes processed {format_bytes(bytes_processed)} is above gcp_max_bytes_scanned={format_bytes(gcp_max_bytes_scanned)}'
+        if gcp_max_bytes_scanned_action == 'warn':
+            operator.log.warning(message)
+        else:
+            raise AirflowException(message)
+
+    return bytes_processed
@@ -0,0 +1,221 @@
+"""Pooled, concurrent and rate limited smtp delivery of alert emails."""
+
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from typing import Any, Dict, List, Optional
+
+
+class RateLimiter:
+    """
+    Thread safe limiter that spaces calls out to at most `max_per_second`.
+
+    :param max_per_second: max number of calls per second, None or 0 means no limit
+    :type max_per_second: float
+    """
+
+    def __init__(self, max_per_second: Optional[float] = None) -> None:
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+class SMTPConnectionPool:
+    """
+    Keeps up to `size` open smtp connections and hands them out one thread at a time.
+
+    Connections are opened lazily and reused across sends until `close` is called. An idle connection is
+    checked with a `NOOP` before it is handed out and replaced if the server has dropped it.
+
+    ssl and starttls verify the server certificate against the system CA store unless a different
+    `ssl_context` is passed.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 25,
+        login: Optional[str] = None,
+        password: Optional[str] = None,
+        use_ssl: bool = False,
+        starttls: bool = False,
+        timeout: int = 30,
+        size: int = 1,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.login = login
+        self.password = password
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.timeout = timeout
+        self.size = max(int(size), 1)
+        self.ssl_context = ssl.create_default_context() if ssl_context is None else ssl_context
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_airflow_connection(cls, conn_id: str = 'smtp_default', size: int = 1) -> 'SMTPConnectionPool':
+        """
+        Build a pool from an airflow smtp connection, extras follow the smtp provider (`disable_ssl`, `disable_tls`, `timeout`).
+        """
+        from airflow.hooks.base import BaseHook
+
+        conn = BaseHook.get_connection(conn_id)
+        extra = conn.extra_dejson
+        use_ssl = not extra.get('disable_ssl', False)
+        return cls(
+            host=conn.host,
+            port=conn.port or (465 if use_ssl else 25),
+            login=conn.login,
+            password=conn.password,
+            use_ssl=use_ssl,
+            starttls=not use_ssl and not extra.get('disable_tls', False),
+            timeout=int(extra.get('timeout', 30)),
+            size=size,
+        )
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            conn.starttls(context=self.ssl_context)
+        if self.login:
+            conn.login(self.login, self.password)
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    @staticmethod
+    def _quit(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    @staticmethod
+    def _is_alive(conn: smtplib.SMTP) -> bool:
+        try:
+            return conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection, it goes back to the pool unless the caller raised.
+        """
+        with self._slots:
+            conn = None
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            # pooled connection may have gone stale (server side idle timeout or reset)
+            if conn is not None and not self._is_alive(conn):
+                self._quit(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                self._quit(conn)
+                raise
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_mime_message(mail_from: str, to: List[str], subject: str, html_content: str, files: Optional[List[str]] = None) -> MIMEMultipart:
+    """
+    Build a multipart html message with any files attached, same shape as airflow's own `send_email`.
+    """
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = subject
+    msg['From'] = mail_from
+    msg['To'] = ', '.join(to)
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+    for fname in files or []:
+        basename = os.path.basename(fname)
+        with open(fname, 'rb') as f:
+            part = MIMEApplication(f.read(), Name=basename)
+        part['Content-Disposition'] = f'attachment; filename="{basename}"'
+        part['Content-ID'] = f'<{basename}>'
+        msg.attach(part)
+    return msg
+
+
+class EmailDelivery:
+    """
+    Sends a batch of emails concurrently over a shared `SMTPConnectionPool`, under an optional rate limit.
+
+    Each email is a dict of `to`, `subject`, `html_content` and optional `files`, same as the kwargs of airflow's `send_email`.
+
+    :param pool: pool of smtp connections, its size caps the number of concurrent sends
+    :type pool: SMTPConnectionPool
+    :param mail_from: sender address
+    :type mail_from: str
+    :param max_per_second: max number of emails sent per second, None means no limit
+    :type max_per_second: float
+    """
+
+    def __init__(self, pool: SMTPConnectionPool, mail_from: str, max_per_second: Optional[float] = None) -> None:
+        self.pool = pool
+        self.mail_from = mail_from
+        self.rate_limiter = RateLimiter(max_per_second)
+
+    def send(self, email: Dict[str, Any]):
+        to = email['to'] if isinstance(email['to'], list) else [email['to']]
+        msg = build_mime_message(self.mail_from, to, email['subject'], email['html_content'], email.get('files'))
+        self.rate_limiter.wait()
+        # no retry once sendmail has started, the server may already have accepted the message
+        with self.pool.connection() as conn:
+            conn.sendmail(self.mail_from, to, msg.as_string())
+
+    def send_all(self, emails: List[Dict[str, Any]]):
+        """
+        Send all emails, every email is attempted and the first error (if any) is raised at the end.
+        """
+        with ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            futures = [executor.submit(self.send, email) for email in emails]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise errors[0]
@@ -0,0 +1,201 @@
+"""Versioned model storage in GCS with a per metric batch manifest and a worker level disk cache of model artifacts."""
+
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class ModelCache:
+    """
+    LRU cache of pickled model artifacts on the worker's local disk, keyed by artifact path.
+
+    Airflow runs each task instance in a freshly forked process, so the cache lives on disk rather than in
+    memory to carry over from one score run to the next. Versioned artifacts are never overwritten so a
+    cached artifact can not go stale, it only saves downloading it again.
+
+    :param cache_dir: directory to keep artifacts in
+    :type cache_dir: str
+    :param max_size: max number of artifacts to keep, least recently used are evicted first
+    :type max_size: int
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 256) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{hashlib.sha256(key.encode()).hexdigest()}.pkl')
+
+    def get(self, key: str) -> Optional[bytes]:
+        file_path = self._file_path(key)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            # mtime marks when an artifact was last used, for eviction
+            os.utime(file_path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write then rename so concurrent tasks on the worker never read a partial artifact
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._file_path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name))
+                except OSError:
+                    pass
+        for _, name in sorted(entries, reverse=True)[self.max_size:]:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+
+model_cache = ModelCache(
+    cache_dir=os.getenv('AIRFLOW_AD_MODEL_CACHE_DIR', f'{tempfile.gettempdir()}/airflow_anomaly_detection_models'),
+    max_size=int(os.getenv('AIRFLOW_AD_MODEL_CACHE_MAX_SIZE', 256)),
+)
+
+
+def make_model_version() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%S%f')
+
+
+class ModelRegistry:
+    """
+    Stores versioned model artifacts for a metric batch plus a manifest pointing at the current version of each metric.
+
+    Layout in the bucket:
+        - `{prefix}/{metric_batch_name}/{metric_name}/{version}.pkl`: one artifact per trained model.
+        - `{prefix}/{metric_batch_name}/manifest.json`: current version and metadata for each metric_name.
+
+    :param bucket: gcs bucket to store models in
+    :type bucket: google.cloud.storage.Bucket
+    :param metric_batch_name: name of the metric batch the models belong to
+    :type metric_batch_name: str
+    :param prefix: path prefix for everything written to the bucket
+    :type prefix: str
+    :param cache: disk cache of model artifacts to read through
+    :type cache: ModelCache
+    """
+
+    def __init__(self, bucket: Any, metric_batch_name: str, prefix: str = 'models', cache: Optional[ModelCache] = None) -> None:
+        self.bucket = bucket
+        self.metric_batch_name = metric_batch_name
+        self.prefix = prefix
+        self.cache = model_cache if cache is None else cache
+        self._manifest = None
+        self._staged = {}
+
+    @property
+    def manifest_path(self) -> str:
+        return f'{self.prefix}/{self.metric_batch_name}/manifest.json'
+
+    def model_path(self, metric_name: str, version: str) -> str:
+        return f'{self.prefix}/{self.metric_batch_name}/{metric_name}/{version}.pkl'
+
+    def legacy_model_path(self, metric_name: str) -> str:
+        return f'{self.prefix}/{metric_name}.pkl'
+
+    def get_manifest(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the manifest once (single gcs call) and reuse it for every metric in the batch.
+        """
+        if self._manifest is None or refresh:
+            blob = self.bucket.blob(self.manifest_path)
+            self._manifest = json.loads(blob.download_as_bytes()) if blob.exists() else {}
+        return self._manifest
+
+    def save(self, metric_name: str, model: Any, version: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Upload a new model version and stage its manifest entry, call `publish` to make staged versions current.
+        """
+        path = self.model_path(metric_name, version)
+        self.bucket.blob(path).upload_from_string(pickle.dumps(model))
+        entry = {
+            'version': version,
+            'path': path,
+            'trained_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            **(metadata or {}),
+        }
+        self._staged[metric_name] = entry
+        return entry
+
+    def publish(self, keep_n_versions: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Merge staged entries into the manifest, metrics not trained in this run keep their current version.
+
+        If keep_n_versions is set, older artifacts beyond the newest keep_n_versions of each metric are deleted
+        once the new manifest is written, the version the manifest points at is always kept.
+        """
+        manifest = {**self.get_manifest(refresh=True), **self._staged}
+        self.bucket.blob(self.manifest_path).upload_from_string(
+            json.dumps(manifest, indent=2, sort_keys=True, default=str),
+            content_type='application/json',
+        )
+        self._manifest = manifest
+        self._staged = {}
+        if keep_n_versions:
+            self.prune(keep_n_versions)
+        return manifest
+
+    def prune(self, keep_n_versions: int) -> List[str]:
+        """
+        Delete all but the newest keep_n_versions artifacts of each metric, returns the deleted paths.
+        """
+        batch_prefix = f'{self.prefix}/{self.metric_batch_name}/'
+        manifest_paths = {entry['path'] for entry in self.get_manifest().values()}
+        metric_paths = {}
+        for blob in self.bucket.list_blobs(prefix=batch_prefix):
+            if blob.name.endswith('.pkl'):
+                metric_name = blob.name[len(batch_prefix):].rsplit('/', 1)[0]
+                metric_paths.setdefault(metric_name, []).append(blob.name)
+        deleted = []
+        for paths in metric_paths.values():
+            # versions are utc timestamps so sort newest first
+            for path in sorted(paths, reverse=True)[keep_n_versions:]:
+                if path not in manifest_paths:
+                    self.bucket.blob(path).delete()
+                    deleted.append(path)
+        return deleted
+
+    def resolve(self, metric_name: str) -> str:
+        """
+        Path of the current model for metric_name, falling back to the legacy unversioned path.
+        """
+        entry = self.get_manifest().get(metric_name)
+        return entry['path'] if entry else self.legacy_model_path(metric_name)
+
+    def load(self, metric_name: str) -> Any:
+        path = self.resolve(metric_name)
+        # legacy artifacts get overwritten in place so are not safe to cache
+        if path == self.legacy_model_path(metric_name):
+            return pickle.loads(self.bucket.blob(path).download_as_bytes())
+        cache_key = f'{getattr(self.bucket, "name", "")}/{path}'
+        data = self.cache.get(cache_key)
+        if data is None:
+            data = self.bucket.blob(path).download_as_bytes()
+            self.cache.put(cache_key, data)
+        return pickle.loads(data)
@@ -5,6 +5,9 @@ from typing import Sequence, Any
 from airflow.models.baseoperator import BaseOperator
 from airflow.providers.google.cloud.hooks.bigquery import BigQueryHook
 
+from airflow_anomaly_detection.bigquery_cost import check_bytes_processed
+from airflow_anomaly_detection.profiling import profile_execute
+
 
 class BigQueryMetricBatchAlertOperator(BaseOperator):
     """
@@ -21,12 +24,16 @@ class BigQueryMetricBatchAlertOperator(BaseOperator):
         super().__init__(**kwargs)
         self.alert_status_sql = alert_status_sql
         
+    @profile_execute
     def execute(self, context: Any):
 
         metric_batch_name = context['params']['metric_batch_name']
 
         bigquery_hook = BigQueryHook(context['params']['gcp_connection_id'])
 
+        # dry run to estimate and guard bytes scanned before running the query
+        check_bytes_processed(self, context, bigquery_hook, self.alert_status_sql)
+
         df_alert = bigquery_hook.get_pandas_df(
             sql=self.alert_status_sql,
             dialect='standard'
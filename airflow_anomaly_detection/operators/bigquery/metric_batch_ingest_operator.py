@@ -5,6 +5,9 @@ from typing import Sequence, Any
 from airflow.models.baseoperator import BaseOperator
 from airflow.providers.google.cloud.hooks.bigquery import BigQueryHook
 
+from airflow_anomaly_detection.bigquery_cost import check_bytes_processed
+from airflow_anomaly_detection.profiling import profile_execute
+
 
 class BigQueryMetricBatchIngestOperator(BaseOperator):
     """
@@ -21,6 +24,7 @@ class BigQueryMetricBatchIngestOperator(BaseOperator):
         super().__init__(**kwargs)
         self.metric_batch_sql = metric_batch_sql
         
+    @profile_execute
     def execute(self, context: Any):
         """
         Executes `insert_job` to generate metrics.
@@ -33,6 +37,9 @@ class BigQueryMetricBatchIngestOperator(BaseOperator):
         bigquery_hook = BigQueryHook(context['params']['gcp_connection_id'])
         gcp_project_id = bigquery_hook.get_client().project
 
+        # dry run to estimate and guard bytes scanned before running the query
+        check_bytes_processed(self, context, bigquery_hook, self.metric_batch_sql)
+
         bigquery_hook.insert_job(
             configuration={
                 "query": {
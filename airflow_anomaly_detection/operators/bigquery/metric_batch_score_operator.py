@@ -7,11 +7,13 @@ from airflow.models.baseoperator import BaseOperator
 from airflow.providers.google.cloud.hooks.bigquery import BigQueryHook
 from airflow.exceptions import AirflowException
 
-import pickle
-import tempfile
 from google.cloud import storage
 import pandas as pd
 
+from airflow_anomaly_detection.model_registry import ModelRegistry
+from airflow_anomaly_detection.bigquery_cost import check_bytes_processed
+from airflow_anomaly_detection.profiling import profile_execute
+
 
 class BigQueryMetricBatchScoreOperator(BaseOperator):
     """
@@ -28,8 +30,10 @@ class BigQueryMetricBatchScoreOperator(BaseOperator):
         super().__init__(**kwargs)
         self.preprocess_sql = preprocess_sql
         
+    @profile_execute
     def execute(self, context: Any):
         
+        metric_batch_name = context['params']['metric_batch_name']
         gcs_model_bucket = os.getenv('AIRFLOW_AD_GCS_MODEL_BUCKET', context['params']['gcs_model_bucket'])
         gcp_destination_dataset = context['params'].get('gcp_destination_dataset', 'develop')
         gcp_score_destination_table_name = context['params'].get('gcp_score_destination_table_name', 'metrics_scored')
@@ -39,6 +43,9 @@ class BigQueryMetricBatchScoreOperator(BaseOperator):
         gcp_project_id = bigquery_client.project
         gcp_credentials = bigquery_client._credentials
 
+        # dry run to estimate and guard bytes scanned before running the query
+        check_bytes_processed(self, context, bigquery_hook, self.preprocess_sql)
+
         df_score = bigquery_hook.get_pandas_df(
             sql=self.preprocess_sql,
             dialect='standard'
@@ -48,6 +55,23 @@ class BigQueryMetricBatchScoreOperator(BaseOperator):
         
             metrics_distinct = df_score['metric_name'].unique()
 
+            # one manifest read resolves the current model version for every metric in the batch
+            storage_client = storage.Client(credentials=gcp_credentials)
+            model_registry = ModelRegistry(storage_client.bucket(gcs_model_bucket), metric_batch_name)
+            try:
+                model_registry.get_manifest()
+            except Exception as e:
+                self.log.error(f"An error occurred: {e}")
+                if context['params'].get('airflow_fail_on_model_load_error', True):
+                    raise AirflowException(f"An error occurred: {e}")
+                else:
+                    # no model can be resolved without the manifest
+                    self.log.info(f"Skipping metric_names {list(metrics_distinct)}")
+                    metrics_distinct = []
+
+            # cache counters are process wide, snapshot them to report on this run only
+            cache_hits_start, cache_misses_start = model_registry.cache.hits, model_registry.cache.misses
+
             # create empty dataframe to store scores
             df_scores = pd.DataFrame()
 
@@ -61,17 +85,10 @@ class BigQueryMetricBatchScoreOperator(BaseOperator):
                 X = df_X[[col for col in df_X.columns if col.startswith('x_')]].values
 
                 try:
-                    # load model from GCS
-                    storage_client = storage.Client(credentials=gcp_credentials)
-                    bucket = storage_client.get_bucket(gcs_model_bucket)
-                    model_name = f'{metric_name}.pkl'
-                    blob = bucket.blob(f'models/{model_name}')
-                    with tempfile.NamedTemporaryFile() as temp:
-                        blob.download_to_filename(temp.name)
-                        with open(temp.name, 'rb') as f:
-                            model = pickle.load(f)
+                    # load model from the worker's disk cache or GCS
+                    model = model_registry.load(metric_name)
                 except Exception as e:
-                    self.log(f"An error occurred: {e}")
+                    self.log.error(f"An error occurred: {e}")
                     if context['params'].get('airflow_fail_on_model_load_error', True):
                         raise AirflowException(f"An error occurred: {e}")
                     else:
@@ -125,6 +142,7 @@ class BigQueryMetricBatchScoreOperator(BaseOperator):
                 project_id=gcp_project_id,
             )
 
+            self.log.info(f'model cache hits={model_registry.cache.hits - cache_hits_start}, misses={model_registry.cache.misses - cache_misses_start}')
             self.log.info(f'{len(df_scores)} rows written into {gcp_project_id}.{gcp_destination_dataset}.{gcp_score_destination_table_name}')
 
         else:
@@ -7,11 +7,14 @@ import time
 from airflow.models.baseoperator import BaseOperator
 from airflow.providers.google.cloud.hooks.bigquery import BigQueryHook
 
-import pickle
 from pyod.models.iforest import IForest
-import tempfile
 from google.cloud import storage
 
+from airflow_anomaly_detection.model_registry import ModelRegistry, make_model_version
+from airflow_anomaly_detection.training_budget import TrainingBudget, fit_iforest_within, sample_positions
+from airflow_anomaly_detection.bigquery_cost import check_bytes_processed
+from airflow_anomaly_detection.profiling import profile_execute
+
 
 class BigQueryMetricBatchTrainOperator(BaseOperator):
     """
@@ -28,51 +31,114 @@ class BigQueryMetricBatchTrainOperator(BaseOperator):
         super().__init__(**kwargs)
         self.preprocess_sql = preprocess_sql
         
+    @profile_execute
     def execute(self, context: Any):
         
+        metric_batch_name = context['params']['metric_batch_name']
         gcp_credentials = BigQueryHook(context['params']['gcp_connection_id']).get_client()._credentials
         gcs_model_bucket = os.getenv('AIRFLOW_AD_GCS_MODEL_BUCKET', context['params']['gcs_model_bucket'])
         model_type = context['params'].get('model_type','iforest')
         model_params = context['params'].get('model_params',{'contamination' : 0.1})
+        train_budget_secs = context['params'].get('train_budget_secs', None)
+        train_budget_n_jobs = context['params'].get('train_budget_n_jobs', 1)
+        model_keep_n_versions = context['params'].get('model_keep_n_versions', None)
 
         bigquery_hook = BigQueryHook(context['params']['gcp_connection_id'])
 
+        # dry run to estimate and guard bytes scanned before running the query
+        check_bytes_processed(self, context, bigquery_hook, self.preprocess_sql)
+
         df_train = bigquery_hook.get_pandas_df(
             sql=self.preprocess_sql,
             dialect='standard'
         )
 
         if len(df_train) > 0:
+
+            storage_client = storage.Client(credentials=gcp_credentials)
+            model_registry = ModelRegistry(storage_client.bucket(gcs_model_bucket), metric_batch_name)
+            model_version = make_model_version()
         
             metrics_distinct = df_train['metric_name'].unique()
 
+            # row positions per metric and x_ column positions, so each metric's rows are taken with a single iloc
+            metric_positions = df_train.groupby('metric_name', sort=False).indices
+            x_col_positions = [i for i, col in enumerate(df_train.columns) if col.startswith('x_')]
+
+            if train_budget_secs:
+                if model_type != 'iforest':
+                    raise ValueError(f'train_budget_secs is not supported for model_type {model_type}')
+                training_budget = TrainingBudget(train_budget_secs, len(metrics_distinct), n_jobs=train_budget_n_jobs)
+                training_budget.calibrate(n_features=len(x_col_positions))
+                self.log.info(
+                    f'train budget calibrated in {round(training_budget.elapsed_secs,2)} secs: secs_per_fit={training_budget.secs_per_fit:.4f}, '
+                    f'secs_per_parallel_fit={training_budget.secs_per_parallel_fit:.4f}, secs_per_tree={training_budget.secs_per_tree:.2e}, '
+                    f'secs_per_tree_row={training_budget.secs_per_tree_row:.2e}'
+                )
+
             for metric_name in metrics_distinct:
 
-                X = df_train[df_train['metric_name'] == metric_name]
-                X = X[[col for col in X.columns if col.startswith('x_')]]
-                
-                # shuffle X
-                X = X.sample(frac=1).reset_index(drop=True)
+                if train_budget_secs:
+                    train_allowance = training_budget.allowance()
+                    train_plan = training_budget.plan(train_allowance, len(metric_positions[metric_name]), model_params)
+                    metric_model_params = {
+                        **model_params,
+                        **{k: train_plan[k] for k in ['max_samples', 'n_estimators', 'n_jobs']},
+                    }
+                    positions = sample_positions(metric_positions[metric_name], train_plan['n_rows'])
+                else:
+                    metric_model_params = model_params
+                    # shuffle
+                    positions = sample_positions(metric_positions[metric_name])
+
+                X = df_train.iloc[positions, x_col_positions].reset_index(drop=True)
 
                 if model_type == 'iforest':
-                    model = IForest(**model_params)
+                    model = IForest(**metric_model_params)
                 else:
                     raise ValueError(f'model_type {model_type} is not supported')
                 
                 time_start_train = time.time()
-                model.fit(X)
+                if train_budget_secs:
+                    train_truncated = fit_iforest_within(model, X, train_allowance)
+                else:
+                    model.fit(X)
                 time_end_train = time.time()
                 train_time = time_end_train - time_start_train
 
-                with tempfile.NamedTemporaryFile() as temp:
-                    pickle.dump(model, temp)
-                    temp.flush()
-                    storage_client = storage.Client(credentials=gcp_credentials)
-                    bucket = storage_client.get_bucket(gcs_model_bucket)
-                    model_name = f'{metric_name}.pkl'
-                    blob = bucket.blob(f'models/{model_name}')
-                    blob.upload_from_filename(temp.name)
-                    self.log.info(f'trained model {model_name} (n={len(X)}, train_time={round(train_time,2)} secs) has been uploaded to gs://{gcs_model_bucket}/models/{model_name}')
+                model_metadata = {
+                    'n': len(X),
+                    'n_features': X.shape[1],
+                    'train_time': round(train_time, 4),
+                    'model_type': model_type,
+                    'model_params': metric_model_params,
+                }
+
+                if train_budget_secs:
+                    training_budget.update(model.n_estimators, len(X), metric_model_params['n_jobs'], train_time)
+                    model_metadata['model_params'] = {**metric_model_params, 'n_estimators': model.n_estimators}
+                    model_metadata['train_allowance'] = round(train_allowance, 4)
+                    model_metadata['train_truncated'] = train_truncated
+                    self.log.info(
+                        f"train budget {metric_name}: train_time={round(train_time,2)} secs vs allowance={round(train_allowance,2)} secs for building and scoring "
+                        f"(estimated={round(train_plan['estimated_secs'],2)} secs, n={len(X)}/{len(metric_positions[metric_name])}, "
+                        f"max_samples={metric_model_params['max_samples']}, n_estimators={model.n_estimators}/{metric_model_params['n_estimators']}, "
+                        f"n_jobs={metric_model_params['n_jobs']}, truncated={train_truncated})"
+                    )
+
+                model_entry = model_registry.save(
+                    metric_name,
+                    model,
+                    version=model_version,
+                    metadata=model_metadata,
+                )
+                self.log.info(f"trained model {metric_name} (n={len(X)}, train_time={round(train_time,2)} secs) has been uploaded to gs://{gcs_model_bucket}/{model_entry['path']}")
+
+            if train_budget_secs:
+                self.log.info(f'train budget: {len(metrics_distinct)} metrics trained in {round(training_budget.elapsed_secs,2)} secs vs budget={train_budget_secs} secs')
+
+            model_registry.publish(keep_n_versions=model_keep_n_versions)
+            self.log.info(f'model version {model_version} published to gs://{gcs_model_bucket}/{model_registry.manifest_path}')
 
         else:
             self.log.info('no training data available')
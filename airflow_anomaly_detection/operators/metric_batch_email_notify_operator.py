@@ -6,6 +6,7 @@ from typing import Any
 
 from airflow.models.baseoperator import BaseOperator
 from airflow.utils.email import send_email
+from airflow.configuration import conf
 from airflow.exceptions import AirflowException
 
 import matplotlib.pyplot as plt
@@ -14,6 +15,9 @@ import numpy as np
 import tempfile
 from ascii_graph import Pyasciigraph
 
+from airflow_anomaly_detection.email_delivery import EmailDelivery, SMTPConnectionPool
+from airflow_anomaly_detection.profiling import profile_execute
+
 
 class ConditionalFormat:
     def __init__(self, threshold=1):
@@ -96,6 +100,43 @@ class MetricBatchEmailNotifyOperator(BaseOperator):
 
         return fp, fname
         
+    def make_digest_email(self, alerts, metric_batch_name, alert_subject_emoji):
+        """
+        Bundle all alerts of a batch run into a single email with one chart per metric attached.
+        """
+
+        metric_timestamp_max = max(alert['metric_timestamp_max'] for alert in alerts)
+        subject = f"{alert_subject_emoji} [{metric_batch_name}] {len(alerts)} metric(s) look anomalous ({metric_timestamp_max}) {alert_subject_emoji}"
+        email_message = '\n\n'.join(f"{alert['subject']}\n{alert['email_message']}" for alert in alerts)
+
+        return {
+            'to': alerts[0]['to'],
+            'subject': subject,
+            'html_content': f"<pre>{email_message}</pre>",
+            'files': [fname for alert in alerts for fname in alert['files']],
+        }
+
+    def send_emails(self, emails, alert_email_delivery, context):
+        """
+        Send emails via airflow's configured email backend (one at a time) or via a pooled smtp connection (concurrently).
+        """
+
+        if alert_email_delivery == 'airflow':
+            for email in emails:
+                send_email(**email)
+        elif alert_email_delivery == 'smtp':
+            alert_smtp_conn_id = context['params'].get('alert_smtp_conn_id', 'smtp_default')
+            alert_email_max_workers = context['params'].get('alert_email_max_workers', 4)
+            alert_email_max_per_second = context['params'].get('alert_email_max_per_second', None)
+            with SMTPConnectionPool.from_airflow_connection(alert_smtp_conn_id, size=min(alert_email_max_workers, len(emails))) as pool:
+                # same sender as airflow's own send_email unless overridden
+                alert_emails_from = context['params'].get('alert_emails_from') or conf.get('smtp', 'smtp_mail_from')
+                EmailDelivery(pool, alert_emails_from, max_per_second=alert_email_max_per_second).send_all(emails)
+                self.log.info(f'{len(emails)} email(s) sent over {pool.connections_opened} smtp connection(s)')
+        else:
+            raise ValueError(f'alert_email_delivery {alert_email_delivery} is not supported')
+
+    @profile_execute
     def execute(self, context: Any):
 
         metric_batch_name = context['params']['metric_batch_name']
@@ -111,6 +152,9 @@ class MetricBatchEmailNotifyOperator(BaseOperator):
         alert_status_threshold = context['params'].get('alert_status_threshold',0.9)
         alert_airflow_fail_on_alert = context['params'].get('alert_airflow_fail_on_alert',False)
 
+        alert_email_digest = context['params'].get('alert_email_digest', False)
+        alert_email_delivery = context['params'].get('alert_email_delivery', 'airflow')
+
         # get df_alert from xcom
         data_alert = context['ti'].xcom_pull(key=f'df_alert_{metric_batch_name}')
         df_alert = pd.DataFrame(data_alert)
@@ -120,50 +164,67 @@ class MetricBatchEmailNotifyOperator(BaseOperator):
 
             df_alert['metric_timestamp'] = pd.to_datetime(df_alert['metric_timestamp']).dt.strftime('%Y-%m-%d %H:%M:%S')
 
-            for metric_name in df_alert['metric_name'].unique():
+            alerts = []
+            temp_files = []
+
+            try:
 
-                df_alert_metric = df_alert[df_alert['metric_name'] == metric_name]
-                metric_timestamp_max = df_alert_metric['metric_timestamp'].max()
+                for metric_name in df_alert['metric_name'].unique():
 
-                alert_lines = self.make_alert_lines(
-                    df_alert_metric=df_alert_metric,
-                    graph_symbol=graph_symbol,
-                    anomaly_symbol=anomaly_symbol,
-                    normal_symbol=normal_symbol,
-                    alert_float_format=alert_float_format
-                )
+                    df_alert_metric = df_alert[df_alert['metric_name'] == metric_name]
+                    metric_timestamp_max = df_alert_metric['metric_timestamp'].max()
 
-                qry_sql = self.make_qry_sql(
-                    metric_name=metric_name,
-                    gcp_destination_dataset=gcp_destination_dataset,
-                    gcp_ingest_destination_table_name=gcp_ingest_destination_table_name,
-                    gcp_score_destination_table_name=gcp_score_destination_table_name
-                )
+                    alert_lines = self.make_alert_lines(
+                        df_alert_metric=df_alert_metric,
+                        graph_symbol=graph_symbol,
+                        anomaly_symbol=anomaly_symbol,
+                        normal_symbol=normal_symbol,
+                        alert_float_format=alert_float_format
+                    )
 
-                subject = f"{alert_subject_emoji} [{metric_name}] looks anomalous ({metric_timestamp_max}) {alert_subject_emoji}"
-                email_message = alert_lines + f'\n\n{qry_sql.lstrip()}'
-                email_message = f"<pre>{email_message}</pre>"
+                    qry_sql = self.make_qry_sql(
+                        metric_name=metric_name,
+                        gcp_destination_dataset=gcp_destination_dataset,
+                        gcp_ingest_destination_table_name=gcp_ingest_destination_table_name,
+                        gcp_score_destination_table_name=gcp_score_destination_table_name
+                    )
 
-                self.log.info(subject)
-                self.log.info(email_message)
+                    subject = f"{alert_subject_emoji} [{metric_name}] looks anomalous ({metric_timestamp_max}) {alert_subject_emoji}"
+                    email_message = alert_lines + f'\n\n{qry_sql.lstrip()}'
 
-                fp, fname = self.make_temp_chart_file(df_alert_metric, metric_name, alert_status_threshold)
+                    self.log.info(subject)
+                    self.log.info(email_message)
+
+                    fp, fname = self.make_temp_chart_file(df_alert_metric, metric_name, alert_status_threshold)
+                    temp_files.append((fp, fname))
+
+                    alerts.append({
+                        'to': alert_emails_to,
+                        'subject': subject,
+                        'html_content': f"<pre>{email_message}</pre>",
+                        'files': [fname],
+                        'metric_timestamp_max': metric_timestamp_max,
+                        'email_message': email_message,
+                    })
+
+                if alert_email_digest:
+                    emails = [self.make_digest_email(alerts, metric_batch_name, alert_subject_emoji)]
+                else:
+                    emails = [{k: alert[k] for k in ['to', 'subject', 'html_content', 'files']} for alert in alerts]
 
-                send_email(
-                    to=alert_emails_to,
-                    subject=subject,
-                    html_content=email_message,
-                    files=[fname]
-                )
+                self.send_emails(emails, alert_email_delivery, context)
 
-                # remove temp file
-                fp.close()
-                os.remove(fname)
+            finally:
+                # remove temp files
+                for fp, fname in temp_files:
+                    fp.close()
+                    os.remove(fname)
 
-                self.log.info(f'alert sent, subject={subject}, to={alert_emails_to}')
+            for email in emails:
+                self.log.info(f"alert sent, subject={email['subject']}, to={alert_emails_to}")
 
-                if alert_airflow_fail_on_alert:
-                    raise AirflowException(f'{subject}{email_message}')  
+            if alert_airflow_fail_on_alert:
+                raise AirflowException(''.join(f"{alert['subject']}<pre>{alert['email_message']}</pre>" for alert in alerts))
 
         else:
 
@@ -0,0 +1,137 @@
+"""Opt-in cProfile and tracemalloc profiling of operator runs."""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Optional
+
+
+def get_profile_modes(airflow_profile: Any) -> set:
+    """
+    Map the `airflow_profile` param to the set of profilers to run.
+
+    `True` or 'all' runs both, 'cprofile' or 'tracemalloc' runs just one, anything falsy runs none.
+    """
+    if not airflow_profile:
+        return set()
+    if airflow_profile is True or airflow_profile == 'all':
+        return {'cprofile', 'tracemalloc'}
+    if airflow_profile in ('cprofile', 'tracemalloc'):
+        return {airflow_profile}
+    raise ValueError(f'airflow_profile {airflow_profile} is not supported')
+
+
+def make_profile_summary(
+    name: str,
+    run_time: float,
+    profiler: Optional[cProfile.Profile],
+    snapshot: Optional[tracemalloc.Snapshot],
+    peak_memory: Optional[int],
+    top_n: int = 25,
+) -> str:
+    lines = [f'profile for {name}', f'run_time={round(run_time, 2)} secs']
+
+    if profiler is not None:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top_n)
+        lines += ['', f'top {top_n} functions by cumulative time', stream.getvalue()]
+
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ])
+        lines += ['', f'peak_memory={round(peak_memory / 1024 ** 2, 2)} MiB', f'top {top_n} allocation sites by size']
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:top_n]]
+
+    return '\n'.join(lines) + '\n'
+
+
+def save_profile(profile_dir: str, profiler: Optional[cProfile.Profile], summary: str, gcp_connection_id: str) -> str:
+    """
+    Write `profile.pstats` and `summary.txt` to a local directory or a `gs://bucket/prefix` path, returns where they went.
+    """
+    if profile_dir.startswith('gs://'):
+        from airflow.providers.google.cloud.hooks.gcs import GCSHook
+
+        bucket_name, _, prefix = profile_dir[len('gs://'):].partition('/')
+        gcs_hook = GCSHook(gcp_conn_id=gcp_connection_id)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            save_profile(temp_dir, profiler, summary, gcp_connection_id)
+            for fname in os.listdir(temp_dir):
+                gcs_hook.upload(bucket_name=bucket_name, object_name=f'{prefix}/{fname}', filename=f'{temp_dir}/{fname}')
+        return f'https://console.cloud.google.com/storage/browser/{bucket_name}/{prefix}'
+
+    os.makedirs(profile_dir, exist_ok=True)
+    if profiler is not None:
+        profiler.dump_stats(f'{profile_dir}/profile.pstats')
+    with open(f'{profile_dir}/summary.txt', 'w') as f:
+        f.write(summary)
+    return profile_dir
+
+
+@contextmanager
+def profile_run(operator: Any, context: Any):
+    """
+    Profile whatever runs inside the block if the `airflow_profile` param is set, does nothing otherwise.
+
+    Output goes to `{airflow_profile_path}/{dag_id}/{task_id}/{run_id}/`. A failure to save the profile is logged and never fails the task.
+    """
+    profile_modes = get_profile_modes(context['params'].get('airflow_profile', False))
+    if not profile_modes:
+        yield
+        return
+
+    airflow_profile_path = os.getenv('AIRFLOW_AD_PROFILE_PATH', context['params'].get('airflow_profile_path', f'{tempfile.gettempdir()}/airflow_anomaly_detection_profiles'))
+    airflow_profile_top_n = context['params'].get('airflow_profile_top_n', 25)
+    gcp_connection_id = context['params'].get('gcp_connection_id', 'google_cloud_default')
+    run_id = re.sub(r'[^A-Za-z0-9_.-]', '_', str(context.get('run_id') or time.strftime('%Y%m%dT%H%M%S')))
+    profile_dir = f"{airflow_profile_path.rstrip('/')}/{operator.dag_id}/{operator.task_id}/{run_id}"
+
+    profiler = cProfile.Profile() if 'cprofile' in profile_modes else None
+    started_tracemalloc = 'tracemalloc' in profile_modes and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+
+    time_start = time.time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        run_time = time.time() - time_start
+        snapshot, peak_memory = None, None
+        if 'tracemalloc' in profile_modes:
+            snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracemalloc:
+                tracemalloc.stop()
+        try:
+            summary = make_profile_summary(f'{operator.dag_id}.{operator.task_id}', run_time, profiler, snapshot, peak_memory, airflow_profile_top_n)
+            profile_location = save_profile(profile_dir, profiler, summary, gcp_connection_id)
+            operator.log.info(f'profile (run_time={round(run_time, 2)} secs) saved to {profile_location}')
+        except Exception as e:
+            operator.log.warning(f'failed to save profile to {profile_dir}: {e}')
+
+
+def profile_execute(execute):
+    """
+    Decorator for an operator's `execute` that wraps the run in `profile_run`.
+    """
+
+    @functools.wraps(execute)
+    def wrapper(self, context: Any):
+        with profile_run(self, context):
+            return execute(self, context)
+
+    return wrapper
@@ -0,0 +1,101 @@
+import os
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+from airflow.exceptions import AirflowException
+from airflow_anomaly_detection.operators.metric_batch_email_notify_operator import MetricBatchEmailNotifyOperator
+from airflow_anomaly_detection.tests.test_email_delivery import LocalSMTPServer
+
+
+def make_alert_rows(metric_names):
+    return [
+        {
+            'metric_name': metric_name,
+            'metric_timestamp': f'2023-01-25 1{i}:00:00',
+            'metric_value': float(i),
+            'alert_status': i % 2,
+            'prob_anomaly_smooth': 0.5,
+        }
+        for metric_name in metric_names for i in range(5)
+    ]
+
+
+# ascii alert lines are not under test here, the flow around building and sending the emails is
+@patch.object(MetricBatchEmailNotifyOperator, 'make_alert_lines', return_value='alert lines')
+class TestMetricBatchEmailNotifyOperator(unittest.TestCase):
+
+    def make_context(self, metric_names, **params):
+        ti = MagicMock()
+        ti.xcom_pull.return_value = make_alert_rows(metric_names)
+        return {
+            'params': {'metric_batch_name': 'test_metric_batch', 'alert_emails_to': 'someone@example.com', **params},
+            'ti': ti,
+        }
+
+    def execute(self, context):
+        sent = []
+
+        def send_email(**email):
+            # attachments must still exist while sending
+            self.assertTrue(all(os.path.exists(fname) for fname in email['files']))
+            sent.append(email)
+
+        with patch('airflow_anomaly_detection.operators.metric_batch_email_notify_operator.send_email', side_effect=send_email):
+            try:
+                MetricBatchEmailNotifyOperator(task_id='test_task').execute(context)
+            finally:
+                # temp chart files are cleaned up whatever happens
+                for email in sent:
+                    self.assertFalse(any(os.path.exists(fname) for fname in email['files']))
+
+        return sent
+
+    def test_email_per_metric(self, mock_make_alert_lines):
+        sent = self.execute(self.make_context(['metric_a', 'metric_b', 'metric_c']))
+
+        self.assertEqual(len(sent), 3)
+        self.assertEqual([len(email['files']) for email in sent], [1, 1, 1])
+        self.assertIn('[metric_a] looks anomalous', sent[0]['subject'])
+
+    def test_digest(self, mock_make_alert_lines):
+        sent = self.execute(self.make_context(['metric_a', 'metric_b', 'metric_c'], alert_email_digest=True))
+
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(len(sent[0]['files']), 3)
+        self.assertIn('[test_metric_batch] 3 metric(s) look anomalous', sent[0]['subject'])
+        for metric_name in ['metric_a', 'metric_b', 'metric_c']:
+            self.assertIn(f'[{metric_name}] looks anomalous', sent[0]['html_content'])
+
+    def test_fail_on_alert_after_all_emails_sent(self, mock_make_alert_lines):
+        context = self.make_context(['metric_a', 'metric_b'], alert_airflow_fail_on_alert=True)
+
+        with patch('airflow_anomaly_detection.operators.metric_batch_email_notify_operator.send_email') as mock_send_email:
+            with self.assertRaises(AirflowException):
+                MetricBatchEmailNotifyOperator(task_id='test_task').execute(context)
+
+        self.assertEqual(mock_send_email.call_count, 2)
+
+    def test_no_alert(self, mock_make_alert_lines):
+        context = self.make_context([])
+
+        with patch('airflow_anomaly_detection.operators.metric_batch_email_notify_operator.send_email') as mock_send_email:
+            MetricBatchEmailNotifyOperator(task_id='test_task').execute(context)
+
+        mock_send_email.assert_not_called()
+
+    def test_smtp_digest(self, mock_make_alert_lines):
+        server = LocalSMTPServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        conn = MagicMock(host='127.0.0.1', port=server.server_address[1], login=None, password=None)
+        conn.extra_dejson = {'disable_ssl': True, 'disable_tls': True}
+        context = self.make_context(['metric_a', 'metric_b', 'metric_c'], alert_email_delivery='smtp', alert_email_digest=True)
+
+        with patch('airflow.hooks.base.BaseHook.get_connection', return_value=conn):
+            MetricBatchEmailNotifyOperator(task_id='test_task').execute(context)
+
+        self.assertEqual(len(server.messages), 1)
+        self.assertEqual(server.messages[0].count('Content-Disposition: attachment'), 3)
+        # no login on the relay so the sender falls back to airflow's smtp_mail_from
+        self.assertRegex(server.messages[0], r'\nFrom: \S+@\S+')
@@ -0,0 +1,89 @@
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+from airflow.exceptions import AirflowException
+from airflow_anomaly_detection.bigquery_cost import DryRunCache, check_bytes_processed, estimate_bytes_processed
+
+
+class TestBigQueryCost(unittest.TestCase):
+
+    def setUp(self):
+        self.bigquery_client = MagicMock(project='test-project')
+        self.bigquery_client.query.return_value.total_bytes_processed = 5 * 1024 ** 3
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = DryRunCache(cache_path=f'{self.temp_dir.name}/cache.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_estimate_is_cached_by_sql(self):
+        self.assertEqual(estimate_bytes_processed(self.bigquery_client, 'select 1', self.cache), (5 * 1024 ** 3, False))
+        self.assertEqual(estimate_bytes_processed(self.bigquery_client, 'select 1', self.cache), (5 * 1024 ** 3, True))
+        self.assertEqual(self.bigquery_client.query.call_count, 1)
+        self.assertTrue(self.bigquery_client.query.call_args.kwargs['job_config'].dry_run)
+
+        # a new process on the same worker picks estimates up from the cache file
+        cache = DryRunCache(cache_path=self.cache.cache_path)
+        self.assertEqual(estimate_bytes_processed(self.bigquery_client, 'select 1', cache), (5 * 1024 ** 3, True))
+        self.assertEqual(estimate_bytes_processed(self.bigquery_client, 'select 2', cache), (5 * 1024 ** 3, False))
+        self.assertEqual(self.bigquery_client.query.call_count, 2)
+
+    def test_expired_estimate_is_refreshed(self):
+        cache = DryRunCache(cache_path=self.cache.cache_path, ttl_secs=-1)
+        estimate_bytes_processed(self.bigquery_client, 'select 1', cache)
+        self.bigquery_client.query.return_value.total_bytes_processed = 6 * 1024 ** 3
+        self.assertEqual(estimate_bytes_processed(self.bigquery_client, 'select 1', cache), (6 * 1024 ** 3, False))
+        self.assertEqual(self.bigquery_client.query.call_count, 2)
+        with open(cache.cache_path) as f:
+            entries = json.load(f)
+        self.assertEqual([entry['bytes_processed'] for entry in entries.values()], [6 * 1024 ** 3])
+
+    def test_expired_in_memory_estimate_reads_fresher_file_entry(self):
+        key = self.cache.make_key('test-project', 'select 1')
+        self.cache.put(key, 1)
+        # another process on the worker refreshes the estimate after ours expired in memory
+        self.cache._entries[key]['estimated_at'] -= 2 * self.cache.ttl_secs
+        DryRunCache(cache_path=self.cache.cache_path).put(key, 2)
+
+        self.assertEqual(self.cache.get(key), 2)
+
+    def test_concurrent_puts_keep_every_entry(self):
+        caches = [DryRunCache(cache_path=self.cache.cache_path) for _ in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for i, cache in enumerate(caches):
+                executor.submit(cache.put, f'key_{i}', i)
+
+        cache = DryRunCache(cache_path=self.cache.cache_path)
+        self.assertEqual([cache.get(f'key_{i}') for i in range(8)], list(range(8)))
+
+    @patch('airflow_anomaly_detection.bigquery_cost.dry_run_cache', new_callable=lambda: DryRunCache())
+    def test_check_bytes_processed(self, mock_cache):
+        operator = MagicMock()
+        bigquery_hook = MagicMock()
+        bigquery_hook.get_client.return_value = self.bigquery_client
+
+        # off unless gcp_dry_run or gcp_max_bytes_scanned is set
+        context = {'params': {}, 'ti': MagicMock()}
+        self.assertIsNone(check_bytes_processed(operator, context, bigquery_hook, 'select 1'))
+        bigquery_hook.get_client.assert_not_called()
+
+        context = {'params': {'gcp_dry_run': True}, 'ti': MagicMock()}
+        self.assertEqual(check_bytes_processed(operator, context, bigquery_hook, 'select 1'), 5 * 1024 ** 3)
+        context['ti'].xcom_push.assert_called_once_with(key='bytes_processed_estimate', value=5 * 1024 ** 3)
+
+        context = {'params': {'gcp_max_bytes_scanned': 1024 ** 3, 'gcp_max_bytes_scanned_action': 'warn'}, 'ti': MagicMock()}
+        check_bytes_processed(operator, context, bigquery_hook, 'select 1')
+        operator.log.warning.assert_called_once()
+
+        context = {'params': {'gcp_max_bytes_scanned': 1024 ** 3}, 'ti': MagicMock()}
+        with self.assertRaises(AirflowException):
+            check_bytes_processed(operator, context, bigquery_hook, 'select 1')
+
+        # a typo in the action fails up front, even for a query under the limit
+        context = {'params': {'gcp_max_bytes_scanned': 10 * 1024 ** 3, 'gcp_max_bytes_scanned_action': 'wran'}, 'ti': MagicMock()}
+        with self.assertRaises(ValueError):
+            check_bytes_processed(operator, context, bigquery_hook, 'select 1')
+
+        self.assertEqual(self.bigquery_client.query.call_count, 1)
@@ -0,0 +1,129 @@
+import socketserver
+import ssl
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from airflow_anomaly_detection.email_delivery import EmailDelivery, SMTPConnectionPool
+
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal smtp stand-in that records each message and connection it receives."""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ready')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                break
+            elif command == 'EHLO':
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while True:
+                    data_line = self.rfile.readline().decode()
+                    if data_line in ('.\r\n', ''):
+                        break
+                    data.append(data_line)
+                with self.server.lock:
+                    self.server.messages.append(''.join(data))
+                self.reply('250 ok')
+            else:
+                self.reply('250 ok')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), LocalSMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+
+
+class TestEmailDelivery(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_send_all_reuses_pooled_connections(self):
+        emails = [
+            {'to': ['someone@example.com'], 'subject': f'alert {i}', 'html_content': f'<pre>{i}</pre>'}
+            for i in range(10)
+        ]
+
+        with SMTPConnectionPool('127.0.0.1', self.port, size=2) as pool:
+            EmailDelivery(pool, 'alerts@example.com', max_per_second=1000).send_all(emails)
+            connections_opened = pool.connections_opened
+
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertLessEqual(connections_opened, 2)
+        self.assertLessEqual(self.server.connections, 2)
+        for i in range(10):
+            self.assertTrue(any(f'Subject: alert {i}\r\n' in message for message in self.server.messages))
+
+    def test_send_attaches_files(self):
+        with SMTPConnectionPool('127.0.0.1', self.port) as pool:
+            EmailDelivery(pool, 'alerts@example.com').send(
+                {'to': 'someone@example.com', 'subject': 'digest', 'html_content': '<pre>2 metrics</pre>', 'files': [__file__, __file__]}
+            )
+
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.messages[0].count('filename="test_email_delivery.py"'), 2)
+
+    def test_send_replaces_stale_pooled_connection(self):
+        with SMTPConnectionPool('127.0.0.1', self.port) as pool:
+            stale_conn = MagicMock()
+            stale_conn.noop.side_effect = ConnectionResetError()
+            pool._idle.put(stale_conn)
+            EmailDelivery(pool, 'alerts@example.com').send(
+                {'to': 'someone@example.com', 'subject': 'stale', 'html_content': '<pre>1 metric</pre>'}
+            )
+
+        stale_conn.sendmail.assert_not_called()
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_send_does_not_retry_after_sendmail_started(self):
+        with SMTPConnectionPool('127.0.0.1', self.port) as pool:
+            conn = MagicMock()
+            conn.noop.return_value = (250, b'ok')
+            conn.sendmail.side_effect = TimeoutError()
+            pool._idle.put(conn)
+            with self.assertRaises(TimeoutError):
+                EmailDelivery(pool, 'alerts@example.com').send(
+                    {'to': 'someone@example.com', 'subject': 'timeout', 'html_content': '<pre>1 metric</pre>'}
+                )
+
+        conn.sendmail.assert_called_once()
+        self.assertEqual(len(self.server.messages), 0)
+        self.assertEqual(self.server.connections, 0)
+
+    def test_ssl_verifies_server_certificate(self):
+        with patch('smtplib.SMTP_SSL') as smtp_ssl:
+            pool = SMTPConnectionPool('smtp.example.com', 465, login='user', password='secret', use_ssl=True)
+            with pool.connection():
+                pass
+        self.assertEqual(smtp_ssl.call_args.kwargs['context'].verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(smtp_ssl.call_args.kwargs['context'].check_hostname)
+
+        with patch('smtplib.SMTP') as smtp:
+            pool = SMTPConnectionPool('smtp.example.com', 587, login='user', password='secret', starttls=True)
+            with pool.connection():
+                pass
+        context = smtp.return_value.starttls.call_args.kwargs['context']
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        smtp.return_value.login.assert_called_once_with('user', 'secret')
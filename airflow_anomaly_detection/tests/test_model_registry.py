@@ -0,0 +1,127 @@
+import os
+import pickle
+import tempfile
+import unittest
+from airflow_anomaly_detection.model_registry import ModelCache, ModelRegistry
+
+
+class FakeBlob:
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data.encode() if isinstance(data, str) else data
+
+    def download_as_bytes(self):
+        self.bucket.downloads.append(self.name)
+        return self.bucket.objects[self.name]
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """In memory stand-in for a google.cloud.storage.Bucket."""
+
+    def __init__(self):
+        self.objects = {}
+        self.downloads = []
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=''):
+        return [FakeBlob(self, name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def make_cache(self, max_size=256):
+        return ModelCache(self.cache_dir.name, max_size=max_size)
+
+    def test_versions_and_manifest(self):
+        registry = ModelRegistry(self.bucket, 'test_batch', cache=self.make_cache())
+        registry.save('metric_a', {'model': 'a1'}, version='v1', metadata={'n': 10})
+        registry.save('metric_b', {'model': 'b1'}, version='v1', metadata={'n': 20})
+        registry.publish()
+
+        registry = ModelRegistry(self.bucket, 'test_batch', cache=self.make_cache())
+        registry.save('metric_a', {'model': 'a2'}, version='v2', metadata={'n': 30})
+        manifest = registry.publish()
+
+        self.assertIn('models/test_batch/metric_a/v1.pkl', self.bucket.objects)
+        self.assertIn('models/test_batch/metric_a/v2.pkl', self.bucket.objects)
+        self.assertEqual(manifest['metric_a']['version'], 'v2')
+        self.assertEqual(manifest['metric_a']['n'], 30)
+        # metrics not retrained keep their current version
+        self.assertEqual(manifest['metric_b']['version'], 'v1')
+
+    def test_load_reads_manifest_once_and_reuses_disk_cache(self):
+        registry = ModelRegistry(self.bucket, 'test_batch', cache=self.make_cache())
+        for metric_name in ['metric_a', 'metric_b', 'metric_c']:
+            registry.save(metric_name, {'model': metric_name}, version='v1')
+        registry.publish()
+        # training does not fill the cache, scoring runs on other workers would never read it
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+        for run in range(3):
+            # a new cache object per run, as each task runs in a freshly forked process
+            cache = self.make_cache()
+            self.bucket.downloads = []
+            registry = ModelRegistry(self.bucket, 'test_batch', cache=cache)
+            for metric_name in ['metric_a', 'metric_b', 'metric_c']:
+                self.assertEqual(registry.load(metric_name), {'model': metric_name})
+            downloaded_models = [name for name in self.bucket.downloads if name.endswith('.pkl')]
+            self.assertEqual(self.bucket.downloads.count('models/test_batch/manifest.json'), 1)
+            self.assertEqual(len(downloaded_models), 3 if run == 0 else 0)
+            self.assertEqual((cache.hits, cache.misses), (0, 3) if run == 0 else (3, 0))
+
+    def test_load_falls_back_to_legacy_path(self):
+        self.bucket.blob('models/metric_a.pkl').upload_from_string(pickle.dumps({'model': 'legacy'}))
+        registry = ModelRegistry(self.bucket, 'old_batch', cache=self.make_cache())
+
+        self.assertEqual(registry.load('metric_a'), {'model': 'legacy'})
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = self.make_cache(max_size=2)
+        cache.put('a', b'a')
+        cache.put('b', b'b')
+        os.utime(cache._file_path('a'), (0, 0))
+        os.utime(cache._file_path('b'), (1, 1))
+        self.assertEqual(cache.get('a'), b'a')
+        cache.put('c', b'c')
+
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), b'a')
+        self.assertEqual(cache.get('c'), b'c')
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 2)
+
+    def test_publish_keeps_n_versions(self):
+        registry = ModelRegistry(self.bucket, 'test_batch', cache=self.make_cache())
+        for version in ['v1', 'v2', 'v3', 'v4']:
+            registry.save('metric_a', {'model': version}, version=version)
+            if version in ['v1', 'v2']:
+                registry.save('metric_b', {'model': version}, version=version)
+            registry.publish(keep_n_versions=2)
+
+        self.assertEqual(
+            sorted(name for name in self.bucket.objects if name.endswith('.pkl')),
+            [
+                'models/test_batch/metric_a/v3.pkl',
+                'models/test_batch/metric_a/v4.pkl',
+                'models/test_batch/metric_b/v1.pkl',
+                'models/test_batch/metric_b/v2.pkl',
+            ],
+        )
+        self.assertEqual(registry.load('metric_b'), {'model': 'v2'})
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from airflow_anomaly_detection.profiling import get_profile_modes, profile_execute
+
+
+class ProfiledOperator:
+
+    dag_id = 'test_dag'
+    task_id = 'test_task'
+
+    def __init__(self):
+        self.log = MagicMock()
+
+    def some_hot_function(self):
+        return [list(range(100)) for _ in range(1000)]
+
+    @profile_execute
+    def execute(self, context):
+        return len(self.some_hot_function())
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_get_profile_modes(self):
+        self.assertEqual(get_profile_modes(False), set())
+        self.assertEqual(get_profile_modes(True), {'cprofile', 'tracemalloc'})
+        self.assertEqual(get_profile_modes('cprofile'), {'cprofile'})
+        with self.assertRaises(ValueError):
+            get_profile_modes('perf')
+
+    def test_profile_execute_saves_profile(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            context = {
+                'params': {'airflow_profile': True, 'airflow_profile_path': temp_dir},
+                'run_id': 'manual__2023-01-25T16:00:00+00:00',
+            }
+            operator = ProfiledOperator()
+
+            self.assertEqual(operator.execute(context), 1000)
+
+            profile_dir = f'{temp_dir}/test_dag/test_task/manual__2023-01-25T16_00_00_00_00'
+            self.assertTrue(os.path.exists(f'{profile_dir}/profile.pstats'))
+            with open(f'{profile_dir}/summary.txt') as f:
+                summary = f.read()
+            self.assertIn('some_hot_function', summary)
+            self.assertIn('top 25 allocation sites by size', summary)
+            operator.log.info.assert_called_once()
+            self.assertIn(profile_dir, operator.log.info.call_args.args[0])
+
+    def test_profile_execute_off_by_default(self):
+        operator = ProfiledOperator()
+
+        self.assertEqual(operator.execute({'params': {}}), 1000)
+        operator.log.info.assert_not_called()
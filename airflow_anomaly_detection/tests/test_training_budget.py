@@ -0,0 +1,141 @@
+import unittest
+from unittest import mock
+import numpy as np
+from pyod.models.iforest import IForest
+from sklearn.ensemble import IsolationForest
+from airflow_anomaly_detection.training_budget import TrainingBudget, fit_iforest_within, sample_positions
+
+
+class TestTrainingBudget(unittest.TestCase):
+
+    def test_plan_within_allowance_keeps_model_params(self):
+        training_budget = TrainingBudget(budget_secs=1000, n_metrics=1)
+
+        plan = training_budget.plan(1000, n_rows=720, model_params={'n_estimators': 250})
+
+        self.assertEqual(plan['n_rows'], 720)
+        self.assertEqual(plan['max_samples'], 256)
+        self.assertEqual(plan['n_estimators'], 250)
+        self.assertLessEqual(plan['estimated_secs'], 1000)
+
+    def test_plan_shrinks_rows_then_estimators(self):
+        training_budget = TrainingBudget(budget_secs=10, n_metrics=1, secs_per_fit=0, secs_per_tree=1e-3, secs_per_tree_row=1e-6)
+
+        plan = training_budget.plan(1, n_rows=100000, model_params={'n_estimators': 100})
+        self.assertEqual(plan['n_estimators'], 100)
+        self.assertEqual(plan['max_samples'], 256)
+        self.assertEqual(plan['n_rows'], 9000)
+        self.assertAlmostEqual(plan['estimated_secs'], 1)
+
+        plan = training_budget.plan(0.05, n_rows=100000, model_params={'n_estimators': 100})
+        self.assertEqual(plan['n_rows'], 256)
+        self.assertEqual(plan['n_estimators'], 39)
+
+        plan = training_budget.plan(0.01, n_rows=100000, model_params={'n_estimators': 100})
+        self.assertEqual(plan['n_estimators'], TrainingBudget.min_estimators)
+        self.assertEqual(plan['max_samples'], plan['n_rows'])
+        self.assertLess(plan['n_rows'], 256)
+
+    def test_plan_with_n_jobs_fits_allowance(self):
+        training_budget = TrainingBudget(budget_secs=100, n_metrics=1, n_jobs=8, secs_per_parallel_fit=0.05)
+
+        for allowance in [0.08, 0.2, 0.5, 1, 10, 100]:
+            plan = training_budget.plan(allowance, n_rows=100000, model_params={'n_estimators': 100})
+            self.assertLessEqual(plan['n_jobs'], max(plan['n_estimators'] // TrainingBudget.min_estimators, 1))
+            self.assertLessEqual(plan['estimated_secs'], allowance * 1.0001)
+
+        # too few trees to use all jobs, so plan with the jobs that will actually run
+        plan = training_budget.plan(0.08, n_rows=100000, model_params={'n_estimators': 100})
+        self.assertEqual(plan['n_jobs'], 1)
+        self.assertEqual(plan['n_estimators'], 13)
+
+    def test_plan_single_job_below_parallel_size(self):
+        training_budget = TrainingBudget(budget_secs=100, n_metrics=1, n_jobs=4, secs_per_fit=0.01, secs_per_parallel_fit=0.25, secs_per_tree=1e-3, secs_per_tree_row=1e-7)
+
+        # (0.25 - 0.01) / (1 - 1 / 4) secs of work before 4 jobs pay back their start up cost
+        self.assertAlmostEqual(training_budget.min_parallel_work_secs(4), 0.32)
+        plan = training_budget.plan(10, n_rows=720, model_params={'n_estimators': 100})
+        self.assertEqual(plan['n_jobs'], 1)
+        self.assertAlmostEqual(plan['estimated_secs'], 0.01 + 100 * (1e-3 + 1e-7 * 720))
+        plan = training_budget.plan(10, n_rows=50000, model_params={'n_estimators': 100})
+        self.assertEqual(plan['n_jobs'], 4)
+        self.assertEqual(plan['n_rows'], 50000)
+
+    def test_allowance_and_update(self):
+        training_budget = TrainingBudget(budget_secs=100, n_metrics=4, secs_per_fit=0.2, secs_per_tree=1e-3, secs_per_tree_row=1e-6)
+
+        self.assertAlmostEqual(training_budget.allowance(), 25, delta=0.1)
+        # actual costs are 0.05 + n_estimators * (2e-3 + 1e-6 * n_rows)
+        # a single fit can not separate the terms, so the per tree and per row costs are scaled to match it
+        training_budget.update(n_estimators=100, n_rows=1000, n_jobs=1, train_time=0.35)
+        self.assertAlmostEqual(training_budget.allowance(), 100 / 3, delta=0.1)
+        self.assertEqual(training_budget.secs_per_fit, 0.2)
+        self.assertAlmostEqual(training_budget.secs_per_tree, 7.5e-4)
+        self.assertAlmostEqual(training_budget.secs_per_tree_row, 7.5e-7)
+
+        # fits varying trees and rows fit every term
+        training_budget.update(n_estimators=100, n_rows=5000, n_jobs=1, train_time=0.75)
+        training_budget.update(n_estimators=300, n_rows=1000, n_jobs=1, train_time=0.95)
+        self.assertAlmostEqual(training_budget.secs_per_fit, 0.05)
+        self.assertAlmostEqual(training_budget.secs_per_tree, 2e-3)
+        self.assertAlmostEqual(training_budget.secs_per_tree_row, 1e-6)
+
+        # parallel fits get their own fixed cost
+        training_budget.update(n_estimators=400, n_rows=1000, n_jobs=4, train_time=0.6)
+        self.assertAlmostEqual(training_budget.secs_per_parallel_fit, 0.3)
+        self.assertAlmostEqual(training_budget.secs_per_fit, 0.05)
+
+    def test_calibrate(self):
+        training_budget = TrainingBudget(budget_secs=100, n_metrics=1, n_jobs=2)
+
+        training_budget.calibrate(n_features=3, rng=np.random.default_rng(0))
+
+        self.assertGreater(training_budget.secs_per_tree, 0)
+        self.assertGreater(training_budget.secs_per_tree_row, 0)
+        self.assertGreaterEqual(training_budget.secs_per_fit, 0)
+        self.assertGreaterEqual(training_budget.secs_per_parallel_fit, 0)
+        # probes are not metrics, their time comes out of the budget but not out of a metric's share
+        self.assertEqual(training_budget.n_metrics_done, 0)
+
+    def test_sample_positions(self):
+        positions = np.arange(10, 20)
+
+        self.assertEqual(sorted(sample_positions(positions)), list(range(10, 20)))
+        sampled = sample_positions(positions, 4)
+        self.assertEqual(len(set(sampled)), 4)
+        self.assertTrue(set(sampled) <= set(positions))
+
+    def test_fit_iforest_within_cuts_off_cleanly(self):
+        X = np.random.default_rng(0).normal(size=(500, 3))
+
+        model = IForest(n_estimators=1000, contamination=0.1)
+        truncated = fit_iforest_within(model, X, time_limit=0)
+
+        self.assertTrue(truncated)
+        self.assertEqual(model.n_estimators, 10)
+        self.assertEqual(len(model.detector_.estimators_), 10)
+        self.assertEqual(model.predict_proba(X).shape, (500, 2))
+
+        model = IForest(n_estimators=30, contamination=0.1)
+        self.assertFalse(fit_iforest_within(model, X, time_limit=60))
+        self.assertEqual(len(model.detector_.estimators_), 30)
+
+    def test_fit_iforest_within_scores_training_rows_once(self):
+        X = np.random.default_rng(0).normal(size=(20000, 3))
+        score_samples = IsolationForest._score_samples
+        scored_rows = []
+
+        def count_score_samples(detector, X):
+            scored_rows.append(X.shape[0])
+            return score_samples(detector, X)
+
+        model = IForest(n_estimators=100, contamination=0.1)
+        with mock.patch.object(IsolationForest, '_score_samples', autospec=True, side_effect=count_score_samples):
+            self.assertFalse(fit_iforest_within(model, X, time_limit=60))
+
+        # one pass over a slice to time scoring, one over all rows for offset_ and the decision scores
+        self.assertEqual(scored_rows, [10000, 20000])
+        self.assertEqual(model.detector_.contamination, 0.1)
+        self.assertAlmostEqual(model.detector_.offset_, np.percentile(model.detector_.score_samples(X), 10))
+        self.assertAlmostEqual(np.mean(model.labels_), 0.1, delta=0.001)
+        np.testing.assert_allclose(model.decision_function(X), model.decision_scores_)
@@ -0,0 +1,279 @@
+"""Wall clock budget for training a metric batch, sizes each metric's model to fit its share of the budget."""
+
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+from pyod.models.iforest import IForest
+from pyod.utils.utility import invert_order
+from scipy.optimize import nnls
+from sklearn.ensemble import IsolationForest
+from sklearn.utils import check_array
+
+
+class TrainingBudget:
+    """
+    Splits a total wall clock budget across the metrics of a batch and plans each metric's model to fit its allowance.
+
+    Fit cost is modelled as `secs_per_fit + n_estimators * (secs_per_tree + secs_per_tree_row * n_rows) / n_jobs`,
+    a fixed start up cost per fit (`secs_per_parallel_fit` when n_jobs > 1), building each tree and scoring the
+    training rows with it. Call `calibrate` before the first `plan` to measure the terms with small probe fits,
+    they are refitted from every actual fit in `update`.
+
+    :param budget_secs: total wall clock budget in seconds for training the batch
+    :type budget_secs: float
+    :param n_metrics: number of metrics to train
+    :type n_metrics: int
+    :param n_jobs: max number of jobs to fit a model with
+    :type n_jobs: int
+    :param secs_per_fit: initial estimate of the fixed cost of a single job fit
+    :type secs_per_fit: float
+    :param secs_per_parallel_fit: initial estimate of the fixed cost of a fit with n_jobs > 1
+    :type secs_per_parallel_fit: float
+    :param secs_per_tree: initial estimate of the cost of building a tree
+    :type secs_per_tree: float
+    :param secs_per_tree_row: initial estimate of the cost of scoring a training row with a tree
+    :type secs_per_tree_row: float
+    """
+
+    min_estimators = 10
+    min_samples = 32
+
+    def __init__(
+        self,
+        budget_secs: float,
+        n_metrics: int,
+        n_jobs: int = 1,
+        secs_per_fit: float = 0.01,
+        secs_per_parallel_fit: float = 0.25,
+        secs_per_tree: float = 5e-3,
+        secs_per_tree_row: float = 2e-7,
+    ) -> None:
+        self.budget_secs = budget_secs
+        self.n_metrics = n_metrics
+        self.n_jobs = max(int(n_jobs), 1)
+        self.secs_per_fit = secs_per_fit
+        self.secs_per_parallel_fit = secs_per_parallel_fit
+        self.secs_per_tree = secs_per_tree
+        self.secs_per_tree_row = secs_per_tree_row
+        self.n_metrics_done = 0
+        self.time_start = time.time()
+        self._fits = []
+
+    @property
+    def elapsed_secs(self) -> float:
+        return time.time() - self.time_start
+
+    def allowance(self) -> float:
+        """
+        Even share of the remaining budget for the next metric, time saved on fast metrics flows on to later ones.
+        """
+        n_metrics_left = max(self.n_metrics - self.n_metrics_done, 1)
+        return max(self.budget_secs - self.elapsed_secs, 0) / n_metrics_left
+
+    def fit_overhead_secs(self, n_jobs: int) -> float:
+        return self.secs_per_parallel_fit if n_jobs > 1 else self.secs_per_fit
+
+    def work_secs(self, n_estimators: int, n_rows: int) -> float:
+        """
+        Single job secs to build n_estimators trees and score n_rows with them, excluding the fixed cost of the fit.
+        """
+        return n_estimators * (self.secs_per_tree + self.secs_per_tree_row * n_rows)
+
+    def estimate_secs(self, n_estimators: int, n_rows: int, n_jobs: int) -> float:
+        return self.fit_overhead_secs(n_jobs) + self.work_secs(n_estimators, n_rows) / n_jobs
+
+    def min_parallel_work_secs(self, n_jobs: int) -> float:
+        """
+        Smallest fit, in single job secs of work, that runs faster with n_jobs than with a single job once the extra start up cost is paid.
+        """
+        if n_jobs <= 1:
+            return float('inf')
+        return max(self.secs_per_parallel_fit - self.secs_per_fit, 0) / (1 - 1 / n_jobs)
+
+    def plan(self, allowance: float, n_rows: int, model_params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Pick n_rows, max_samples, n_estimators and n_jobs for a metric so its fit is estimated to fit the allowance.
+
+        Shrinks the number of training rows (down to max_samples) first, then the number of trees and only then
+        the size of each tree. Fits too small to pay back the start up cost of extra jobs get a single job.
+        """
+        n_estimators_max = int(model_params.get('n_estimators', 100))
+        max_samples = model_params.get('max_samples', 'auto')
+        if max_samples == 'auto':
+            max_samples = 256
+        elif isinstance(max_samples, float):
+            max_samples = int(max_samples * n_rows)
+        max_samples_max = max(min(int(max_samples), n_rows), 1)
+
+        def rows_within(work_secs: float, n_estimators: int) -> float:
+            return (work_secs / n_estimators - self.secs_per_tree) / self.secs_per_tree_row
+
+        n_jobs = min(self.n_jobs, max(n_estimators_max // self.min_estimators, 1))
+        if self.work_secs(n_estimators_max, n_rows) < self.min_parallel_work_secs(n_jobs):
+            n_jobs = 1
+        while True:
+            budget_work_secs = max(allowance - self.fit_overhead_secs(n_jobs), 0) * n_jobs
+
+            n_estimators = n_estimators_max
+            max_samples = max_samples_max
+            n_rows_used = int(min(max(rows_within(budget_work_secs, n_estimators), max_samples), n_rows))
+            if self.work_secs(n_estimators, n_rows_used) > budget_work_secs:
+                n_estimators = int(min(max(budget_work_secs / self.work_secs(1, n_rows_used), self.min_estimators), n_estimators_max))
+            if self.work_secs(n_estimators, n_rows_used) > budget_work_secs:
+                n_rows_used = int(min(max(rows_within(budget_work_secs, n_estimators), min(self.min_samples, n_rows)), n_rows_used))
+                max_samples = min(max_samples, n_rows_used)
+
+            # fewer trees can mean fewer jobs than the budget assumed, if so plan again with that many jobs
+            n_jobs_used = min(n_jobs, max(n_estimators // self.min_estimators, 1))
+            if n_jobs_used == n_jobs:
+                break
+            n_jobs = n_jobs_used
+
+        return {
+            'n_rows': n_rows_used,
+            'max_samples': max_samples,
+            'n_estimators': n_estimators,
+            'n_jobs': n_jobs,
+            'estimated_secs': self.estimate_secs(n_estimators, n_rows_used, n_jobs),
+        }
+
+    def calibrate(self, n_features: int, rng: Optional[np.random.Generator] = None):
+        """
+        Time small probe fits on random data so the first metric is planned from measured costs rather than guesses.
+
+        Single job fits varying the number of trees and rows separate the fixed, per tree and per row costs,
+        a fit with n_jobs measures the start up cost of a parallel fit.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        n_features = max(n_features, 1)
+        # untimed so one off first call costs do not end up in the fixed cost
+        IsolationForest(n_estimators=1).fit(rng.normal(size=(self.min_samples, n_features)))
+        probes = [(self.min_estimators, 256, 1), (3 * self.min_estimators, 256, 1), (self.min_estimators, 16384, 1)]
+        if self.n_jobs > 1:
+            probes.append((self.min_estimators * self.n_jobs, 256, self.n_jobs))
+        for n_estimators, n_rows, n_jobs in probes:
+            X = rng.normal(size=(n_rows, n_features))
+            time_start_fit = time.time()
+            detector = IsolationForest(n_estimators=n_estimators, n_jobs=n_jobs).fit(X)
+            detector.score_samples(X)
+            self._fits.append((n_estimators, n_rows, n_jobs, time.time() - time_start_fit))
+        self._fit_cost_model()
+
+    def update(self, n_estimators: int, n_rows: int, n_jobs: int, train_time: float):
+        """
+        Record an actual fit, refitting the cost model used to plan the remaining metrics.
+        """
+        self.n_metrics_done += 1
+        self._fits.append((n_estimators, n_rows, n_jobs, train_time))
+        self._fit_cost_model()
+
+    def _fit_cost_model(self):
+        """
+        Non negative least squares fit of the cost terms to every fit so far.
+
+        Until the fits can tell the terms apart (or if they are too noisy to give positive per tree and per row
+        costs) the fixed costs keep their current value and the per tree and per row costs are scaled together.
+        """
+        n_estimators, n_rows, n_jobs, train_time = (np.array(values, dtype=float) for values in zip(*self._fits))
+        A = np.column_stack([n_jobs == 1, n_jobs > 1, n_estimators / n_jobs, n_estimators * n_rows / n_jobs]).astype(float)
+        observed = A.any(axis=0)
+        if np.linalg.matrix_rank(A[:, observed]) == observed.sum():
+            terms, _ = nnls(A, train_time)
+            if terms[2] > 0 and terms[3] > 0:
+                if observed[0]:
+                    self.secs_per_fit = float(terms[0])
+                if observed[1]:
+                    self.secs_per_parallel_fit = float(terms[1])
+                self.secs_per_tree, self.secs_per_tree_row = float(terms[2]), float(terms[3])
+                return
+        overhead_secs = A[:, 0] * self.secs_per_fit + A[:, 1] * self.secs_per_parallel_fit
+        work_secs = A[:, 2] * self.secs_per_tree + A[:, 3] * self.secs_per_tree_row
+        # fits faster than the fixed cost guess leave nothing for the work, then put all the time down to the work
+        observed_work_secs = np.sum(train_time - overhead_secs)
+        scale = (observed_work_secs if observed_work_secs > 0 else np.sum(train_time)) / np.sum(work_secs)
+        if scale > 0:
+            self.secs_per_tree *= float(scale)
+            self.secs_per_tree_row *= float(scale)
+
+
+def sample_positions(positions: np.ndarray, n_rows: Optional[int] = None, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Shuffled sample of `n_rows` row positions (all of them by default), used to take rows with a single `iloc`.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if n_rows is None or n_rows >= len(positions):
+        return rng.permutation(positions)
+    return rng.choice(positions, size=n_rows, replace=False)
+
+
+def fit_iforest_within(model: IForest, X: Any, time_limit: float) -> bool:
+    """
+    Fit a pyod IForest by growing its trees in chunks and stop adding trees once time_limit secs would be exceeded.
+
+    This mirrors `IForest.fit` but builds the underlying `IsolationForest` with `warm_start`, so a cut off
+    fit still leaves a usable model with fewer trees. Returns True if the fit was cut off.
+
+    time_limit covers building the trees and the final pass scoring the training rows. The scoring pass is
+    projected from timing it once on a slice of the rows after the first chunk. The first chunk is always built.
+    Chunks are grown with `contamination='auto'` and `offset_` is set from the model's contamination in that
+    final pass, so the training rows are scored once rather than after every chunk.
+
+    :param model: unfitted IForest, its n_estimators is set to the number of trees actually built
+    :type model: IForest
+    :param X: training data
+    :param time_limit: max seconds to spend fitting
+    :type time_limit: float
+    """
+    time_start = time.time()
+    X = check_array(X)
+    model._set_n_classes(None)
+
+    chunk_size = 10 * model.n_jobs if model.n_jobs and model.n_jobs > 1 else 10
+    detector = IsolationForest(
+        n_estimators=min(chunk_size, model.n_estimators),
+        max_samples=model.max_samples,
+        # 'auto' skips rescoring every training row with every tree after each chunk to set offset_
+        contamination='auto',
+        max_features=model.max_features,
+        bootstrap=model.bootstrap,
+        n_jobs=model.n_jobs,
+        random_state=model.random_state,
+        verbose=model.verbose,
+        warm_start=True,
+    )
+
+    truncated = False
+    n_trees_built = 0
+    secs_score_per_tree_row = None
+    while True:
+        time_start_chunk = time.time()
+        detector.fit(X)
+        secs_per_tree = (time.time() - time_start_chunk) / (detector.n_estimators - n_trees_built)
+        n_trees_built = detector.n_estimators
+        if n_trees_built >= model.n_estimators:
+            break
+        if secs_score_per_tree_row is None:
+            X_slice = X[:10000]
+            time_start_score = time.time()
+            detector.decision_function(X_slice)
+            secs_score_per_tree_row = (time.time() - time_start_score) / (n_trees_built * len(X_slice))
+        n_trees_next = min(n_trees_built + chunk_size, model.n_estimators)
+        secs_build_next = secs_per_tree * (n_trees_next - n_trees_built)
+        secs_score = secs_score_per_tree_row * n_trees_next * X.shape[0]
+        if time.time() - time_start + secs_build_next + secs_score > time_limit:
+            truncated = True
+            break
+        detector.n_estimators = n_trees_next
+
+    # score the training rows once with the final trees, both for offset_ and the decision scores
+    scores = detector.score_samples(X)
+    detector.contamination = model.contamination
+    detector.offset_ = np.percentile(scores, 100.0 * model.contamination)
+
+    model.n_estimators = detector.n_estimators
+    model.detector_ = detector
+    model.decision_scores_ = invert_order(scores - detector.offset_)
+    model._process_decision_scores()
+
+    return truncated